@@ -1,17 +1,32 @@
+import io
 import os
-import json
-from flask import Flask, render_template, request, send_file, session, abort
+import re
+import orjson
+import aiofiles
+import textwrap
+import asyncio
+import threading
+import time
+import hashlib
+import hmac
+import atexit
+import queue
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import quote, unquote
+import numpy as np
+from flask import Flask, Response, jsonify, render_template, request, session, abort, send_from_directory, stream_with_context
 import google.generativeai as genai
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from markdown import markdown  
+from fpdf import FPDF, XPos, YPos
+import mistune
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY", "supersecretkey12345")  # Secure secret key
 app.config["SESSION_PERMANENT"] = False  # Ensure session expires on browser close
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE") == "1"  # Let the front-end server send files
 
 # Configure Google Gemini API
 API_KEY = os.getenv("GOOGLE_API_KEY")  # Secure API Key handling
@@ -19,10 +34,317 @@ if not API_KEY:
     raise ValueError("Missing Google Gemini API Key! Set GOOGLE_API_KEY as an environment variable.")
 
 genai.configure(api_key=API_KEY)
+GEMINI = genai.GenerativeModel("gemini-pro")  # Shared model, reused across requests
+
+# Flask runs each async view on its own short-lived event loop, but the async Gemini client's
+# gRPC channel is bound to the loop it was created on. Running every Gemini call on one
+# long-lived loop keeps a single persistent HTTP/2 channel shared by all requests.
+_gemini_loop = asyncio.new_event_loop()
+threading.Thread(target=_gemini_loop.run_forever, name="gemini-loop", daemon=True).start()
+
+
+async def on_gemini_loop(coro):
+    """Awaits a Gemini coroutine on the shared long-lived event loop."""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, _gemini_loop))
 
 # Directory for saving resumes
 SAVE_DIR = "saves"
 os.makedirs(SAVE_DIR, exist_ok=True)
+RESUME_SUFFIX = "_resume.json"
+RESUME_REQUIRED_FIELDS = ["name", "job_title", "experience_summary", "work_experience", "education", "skills"]
+BATCH_CONCURRENCY = 4  # Max saved resumes regenerated at once by /batch_regenerate
+BATCH_REGENERATE_TOKEN = os.getenv("BATCH_REGENERATE_TOKEN")  # /batch_regenerate is disabled unless set
+_batch_job = None  # Future of the running /batch_regenerate job, if any
+_batch_lock = threading.Lock()
+# Overlaps blocking Gemini calls in synchronous routes; sized like asgi.py's request pool, since
+# each streaming request may hold one EXEC thread for its cover letter
+EXEC = ThreadPoolExecutor(max_workers=int(os.getenv("WSGI_THREADS", "64")))
+
+# In-memory index of saved resume names. This process's saves update it directly; SAVE_DIR is
+# rescanned on first use and then every SAVED_RESUMES_RESCAN_SECONDS to pick up other workers' saves
+# (its mtime is no use as a trigger, since every atomic save renames a file into it).
+SAVED_RESUMES_RESCAN_SECONDS = int(os.getenv("SAVED_RESUMES_RESCAN_SECONDS", "60"))
+_saved_resumes = set()
+_saved_since_scan = set()  # Names saved while a rescan is running, merged into its result
+_saved_resumes_scanned_at = None  # time.monotonic() of the last rescan
+_saved_resumes_lock = threading.Lock()
+_saved_digests = {}  # filename -> (BLAKE2b digest, file signature) of this process's last successful write
+
+# Cache of Gemini responses, keyed by a hash of model name + prompt
+CACHE_DIR = os.path.join(SAVE_DIR, "cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
+CACHE_MAX_ENTRIES = 512
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()  # Shared by request threads and EXEC workers
+
+# Semantic cache: prompt embeddings matched by cosine similarity against earlier prompts.
+# Rows carry a scope hash (e.g. of name/job title) and only match rows with the same scope,
+# so one person's resume is never served for another's prompt. Each worker process keeps an
+# in-memory index of at most SEMANTIC_MAX_ENTRIES rows (oldest evicted first) and snapshots it
+# to semantic_index.<pid>.npz every SEMANTIC_FLUSH_SECONDS; at startup all files are merged and
+# files left behind by exited workers are folded into this process's file and deleted.
+EMBEDDING_MODEL = "models/text-embedding-004"
+SEMANTIC_THRESHOLD = 0.95
+SEMANTIC_MAX_ENTRIES = CACHE_MAX_ENTRIES
+SEMANTIC_FLUSH_SECONDS = 30
+SEMANTIC_INDEX_PREFIX = "semantic_index."
+SEMANTIC_INDEX_FILE = os.path.join(CACHE_DIR, f"{SEMANTIC_INDEX_PREFIX}{os.getpid()}.npz")
+
+
+ATS_MAX_RESUME_CHARS = 8000  # ~2k tokens; bounds the cost and latency of the ATS prompt
+
+# Gemini prompt templates, dedented once at import so no indentation is sent (or billed) per request
+RESUME_PROMPT = textwrap.dedent("""
+    Create a professional ATS-optimized resume for {name}, applying for {job_title}.
+    - **Professional Summary** (Concise, keyword-rich)
+    - **Education** (Degrees, Institutions)
+    - **Work Experience** (2-4 positions with bullet points)
+    - **Certifications** (If applicable)
+    - **Skills** (Optimized for ATS parsing)
+
+    Experience Summary: {experience_summary}
+    Work Experience: {work_experience}
+    Education: {education}
+    Certifications: {certifications}
+    Skills: {skills}
+""").strip()
+
+ATS_PROMPT = textwrap.dedent("""
+    Analyze this resume for ATS (Applicant Tracking System) compatibility.
+    - Provide an **ATS Score (0-100)**
+    - Identify **missing critical keywords**
+    - Suggest **improvements for better ATS ranking**
+
+    Resume Text:
+    {resume_text}
+""").strip()
+
+COVER_LETTER_PROMPT = textwrap.dedent("""
+    Write a compelling, ATS-friendly personalized cover letter for {name} applying to {company} as a {job_title}.
+
+    Guidelines:
+    - Start with a strong **introduction** addressing the hiring manager.
+    - Highlight **why you're the perfect fit** (using experience & skills).
+    - End with a **call to action** requesting an interview.
+    - Keep the tone **professional, confident, and enthusiastic**.
+
+    Experience Summary: {experience_summary}
+    Skills: {skills}
+""").strip()
+
+
+# Write-behind queue for saved resumes and cached responses, drained in batches by a background thread
+WRITE_BATCH_SIZE = 32
+_write_queue = queue.Queue()
+_pending_writes = {}  # filename -> payload not yet on disk, so reads see queued saves
+_pending_lock = threading.Lock()
+_UMASK = os.umask(0)  # Read once at import; os.umask can only be read by setting it
+os.umask(_UMASK)
+
+
+def write_atomic(filename, payload):
+    """Writes bytes to a temp file beside filename and renames it into place, so readers in
+    other processes never see a truncated or partially written file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filename), prefix=".", suffix=".tmp")
+    try:
+        os.fchmod(fd, 0o666 & ~_UMASK)  # mkstemp creates 0600; give saves the usual open() permissions
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _resume_writer():
+    """Drains queued file writes in batches so request handlers never block on disk I/O."""
+    while True:
+        batch = [_write_queue.get()]
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        for filename, payload, on_written in batch:
+            try:
+                write_atomic(filename, payload)
+                if on_written is not None:
+                    on_written(os.stat(filename))
+            except OSError as e:
+                print(f"⚠️ Error writing {filename}: {e}")
+            with _pending_lock:
+                if _pending_writes.get(filename) is payload:
+                    del _pending_writes[filename]
+            _write_queue.task_done()
+
+
+threading.Thread(target=_resume_writer, name="resume-writer", daemon=True).start()
+atexit.register(_write_queue.join)  # Flush queued saves before the process exits
+
+
+# ✅ Function to queue a file write for the background writer
+def queue_write(filename, payload, on_written=None):
+    """Queues bytes to be written to filename without blocking the caller on disk I/O.
+    on_written, if given, is called with the file's os.stat_result after a successful write."""
+    with _pending_lock:
+        _pending_writes[filename] = payload
+    _write_queue.put((filename, payload, on_written))
+
+
+# In-memory semantic index: row buffers grow by doubling up to SEMANTIC_MAX_ENTRIES, then are reused as a ring
+_semantic_embeddings = None  # (capacity, dim) float32; rows [0, _semantic_count) are valid
+_semantic_scopes = np.empty(0, dtype="U32")
+_semantic_keys = []
+_semantic_count = 0
+_semantic_next = 0  # Slot the next insert overwrites once the index is full (i.e. the oldest row)
+_semantic_dirty = False  # Rows changed since the last flush to SEMANTIC_INDEX_FILE
+_semantic_lock = threading.Lock()
+
+
+def _append_semantic_row(embedding, key, scope):
+    """Stores one row in amortised O(1), evicting the oldest row once the index is full. Caller holds _semantic_lock."""
+    global _semantic_embeddings, _semantic_scopes, _semantic_count, _semantic_next, _semantic_dirty
+    if _semantic_count < SEMANTIC_MAX_ENTRIES:
+        if _semantic_embeddings is None or _semantic_count == len(_semantic_embeddings):
+            capacity = min(max(2 * _semantic_count, 16), SEMANTIC_MAX_ENTRIES)
+            embeddings = np.empty((capacity, len(embedding)), dtype=np.float32)
+            scopes = np.empty(capacity, dtype=_semantic_scopes.dtype)
+            if _semantic_count:
+                embeddings[:_semantic_count] = _semantic_embeddings[:_semantic_count]
+                scopes[:_semantic_count] = _semantic_scopes[:_semantic_count]
+            _semantic_embeddings, _semantic_scopes = embeddings, scopes
+            _semantic_keys.extend([None] * (capacity - len(_semantic_keys)))
+        slot = _semantic_count
+        _semantic_count += 1
+    else:
+        slot = _semantic_next
+        _semantic_next = (_semantic_next + 1) % SEMANTIC_MAX_ENTRIES
+    _semantic_embeddings[slot] = embedding
+    _semantic_scopes[slot] = scope
+    _semantic_keys[slot] = key
+    _semantic_dirty = True
+
+
+def flush_semantic_index():
+    """Queues a snapshot of the in-memory index for SEMANTIC_INDEX_FILE if it changed since the last flush."""
+    global _semantic_dirty
+    with _semantic_lock:
+        if not _semantic_dirty:
+            return
+        order = np.roll(np.arange(_semantic_count), -_semantic_next)  # Oldest row first
+        embeddings, scopes = _semantic_embeddings[order], _semantic_scopes[order]  # Fancy indexing copies
+        keys = [_semantic_keys[i] for i in order]
+        _semantic_dirty = False
+    buffer = io.BytesIO()
+    np.savez(buffer, embeddings=embeddings, keys=np.array(keys), scopes=scopes)
+    queue_write(SEMANTIC_INDEX_FILE, buffer.getvalue())
+
+
+def _semantic_flusher():
+    """Periodically persists the semantic index so cache misses never serialise it inline."""
+    while True:
+        time.sleep(SEMANTIC_FLUSH_SECONDS)
+        flush_semantic_index()
+
+
+def _pid_alive(pid):
+    """Returns whether a process with this pid currently exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # Exists but owned by another user
+    return True
+
+
+def load_semantic_index():
+    """Merges every worker's persisted rows into this process's index, then compacts files left by exited workers
+    into SEMANTIC_INDEX_FILE and deletes them."""
+    rows, stale = {}, []
+    for file in sorted(os.listdir(CACHE_DIR)):
+        if not (file.startswith(SEMANTIC_INDEX_PREFIX) and file.endswith(".npz")):
+            continue
+        path = os.path.join(CACHE_DIR, file)
+        try:
+            with np.load(path) as data:
+                for row, key, scope in zip(data["embeddings"], data["keys"], data["scopes"]):
+                    rows.setdefault(str(key), (row, str(scope)))
+        except (OSError, KeyError, ValueError) as e:
+            print(f"⚠️ Error loading semantic cache {file}: {e}")
+            continue
+        pid = file[len(SEMANTIC_INDEX_PREFIX):-len(".npz")]
+        if path != SEMANTIC_INDEX_FILE and not (pid.isdigit() and _pid_alive(int(pid))):
+            stale.append(path)
+
+    with _semantic_lock:
+        for key, (row, scope) in list(rows.items())[-SEMANTIC_MAX_ENTRIES:]:
+            _append_semantic_row(row, key, scope)
+    if stale:
+        flush_semantic_index()
+        _write_queue.join()
+        if os.path.exists(SEMANTIC_INDEX_FILE):  # Only drop the old files once their rows are safely merged
+            for path in stale:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"⚠️ Error removing semantic cache {path}: {e}")
+
+
+load_semantic_index()
+threading.Thread(target=_semantic_flusher, name="semantic-flusher", daemon=True).start()
+atexit.register(flush_semantic_index)  # Runs before the write queue is joined (atexit is LIFO)
+
+
+# Markdown renderer for ATS feedback, created once and reused
+_markdown = mistune.create_markdown()
+
+
+# ✅ Function to render Gemini markdown as HTML
+@lru_cache(maxsize=CACHE_MAX_ENTRIES)
+def render_markdown(text):
+    """Renders markdown text to HTML, memoising repeated (e.g. cached) feedback."""
+    return _markdown(text)
+
+
+# PDF layout (fpdf2 units are mm) and line classifier, built once at import
+PDF_ENCODING = "cp1252"  # Core Helvetica font encoding; covers bullets and smart quotes
+PDF_SECTION_GAP = 5
+PDF_LINE_HEIGHT = 5
+PDF_CACHE_SIZE = 64
+# **Header** lines, "- item" / "* item" bullets (whitespace required, so "-5%" stays text), or plain text
+PDF_LINE_RE = re.compile(r"^\s*(?:\*\*(?P<header>.*?)\*\*(?P<rest>.*)|[-*]\s+(?P<bullet>.*)|(?P<text>.*))$")
+
+
+# ✅ Function to render resume text as PDF bytes
+@lru_cache(maxsize=PDF_CACHE_SIZE)
+def render_pdf(text):
+    """Renders resume text as an ATS-friendly PDF, memoised so re-downloads skip layout."""
+    pdf = FPDF(format="letter")
+    pdf.core_fonts_encoding = PDF_ENCODING
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 20)
+    pdf.cell(0, 12, "Resume", align="C", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(PDF_SECTION_GAP)
+
+    text = text.encode(PDF_ENCODING, "replace").decode(PDF_ENCODING)
+    for match in map(PDF_LINE_RE.match, text.split("\n")):
+        header, rest, bullet, plain = match.group("header", "rest", "bullet", "text")
+        if header is not None:  # Bold formatting for headers
+            pdf.ln(PDF_SECTION_GAP)
+            pdf.set_font("Helvetica", "B", 14)
+            pdf.multi_cell(0, 7, (header + rest).replace("**", ""), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        elif bullet is not None:
+            pdf.set_font("Helvetica", "", 11)
+            pdf.multi_cell(0, PDF_LINE_HEIGHT, f"• {bullet.replace('**', '')}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        elif plain.strip():
+            pdf.set_font("Helvetica", "", 11)
+            pdf.multi_cell(0, PDF_LINE_HEIGHT, plain.replace("**", ""), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        else:
+            pdf.ln(PDF_LINE_HEIGHT)
+
+    return bytes(pdf.output())
 
 
 # ✅ Function to save text as a properly formatted PDF
@@ -31,42 +353,97 @@ def save_to_pdf(text, filename):
     if not text.strip():
         text = "No content available."
 
-    doc = SimpleDocTemplate(filename, pagesize=letter)
-    styles = getSampleStyleSheet()
-    elements = [Paragraph("<b>Resume</b>", styles["Title"]), Spacer(1, 0.2 * inch)]
+    with open(filename, "wb") as f:
+        f.write(render_pdf(text))
+
+
+# ✅ Function to map a resume name to its JSON file
+def _resume_path(name):
+    """Returns the JSON path for a resume name. Names are percent-encoded (spaces become '_'), so
+    the mapping is reversible, distinct names never share a file and '/' cannot leave SAVE_DIR."""
+    stem = quote(name, safe=" ").replace("_", "%5F").replace(" ", "_")
+    return os.path.join(SAVE_DIR, f"{stem}{RESUME_SUFFIX}")
 
-    for line in text.split("\n"):
-        if "**" in line:  # Bold formatting for headers
-            elements.append(Spacer(1, 0.2 * inch))
-            elements.append(Paragraph(f"<b>{line.replace('**', '')}</b>", styles["Heading2"]))
-        elif "-" in line:
-            elements.append(Paragraph(f"• {line.replace('-', '')}", styles["Normal"]))
-        else:
-            elements.append(Paragraph(line, styles["Normal"]))
 
-    doc.build(elements)
+# ✅ Function to map a resume JSON file back to its display name
+def _resume_name(filename):
+    """Returns the display name for a saved resume file name."""
+    return unquote(filename[:-len(RESUME_SUFFIX)].replace("_", " "))
+
+
+# ✅ Function to rename resumes saved under the old, unencoded file names
+def _migrate_legacy_resumes():
+    """Renames saved resumes whose file name is not in the encoded form (e.g. "O'Brien_resume.json")
+    so they can be loaded again; files whose encoded name is already taken are left alone."""
+    with os.scandir(SAVE_DIR) as entries:
+        legacy = [entry.name for entry in entries if entry.name.endswith(RESUME_SUFFIX) and entry.is_file()
+                  and os.path.basename(_resume_path(_resume_name(entry.name))) != entry.name]
+    for file in legacy:
+        target = _resume_path(_resume_name(file))
+        if os.path.exists(target):
+            print(f"⚠️ Skipping legacy resume {file}: {os.path.basename(target)} already exists")
+            continue
+        try:
+            os.replace(os.path.join(SAVE_DIR, file), target)
+        except OSError as e:  # Another worker may have migrated it first
+            print(f"⚠️ Error migrating legacy resume {file}: {e}")
+
+
+_migrate_legacy_resumes()
+
+
+# ✅ Function to identify a specific version of a file on disk
+def _file_signature(stat):
+    """Returns (inode, size, mtime) for a stat result; it changes whenever the file is replaced."""
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
 
 
 # ✅ Function to save resume data as JSON
 def save_resume_data(name, resume_data):
-    """Saves resume data as a JSON file."""
-    filename = os.path.join(SAVE_DIR, f"{name.replace(' ', '_')}_resume.json")
+    """Queues resume data to be written as a JSON file by the background writer."""
+    filename = _resume_path(name)
     try:
-        with open(filename, "w") as f:
-            json.dump(resume_data, f, indent=4)
-    except Exception as e:
+        payload = orjson.dumps(resume_data, option=orjson.OPT_INDENT_2)
+    except orjson.JSONEncodeError as e:
         print(f"⚠️ Error saving data: {e}")
+        return
+    with _pending_lock:
+        if _pending_writes.get(filename) == payload:
+            return  # The same content is already queued for writing
+
+    # Skip the write only if this process wrote the same content and the file on disk is still
+    # that write (another worker may have replaced it since)
+    digest = hashlib.blake2b(payload, digest_size=16).digest()
+    recorded = _saved_digests.get(filename)
+    if recorded is not None and recorded[0] == digest:
+        try:
+            if _file_signature(os.stat(filename)) == recorded[1]:
+                return
+        except OSError:
+            pass
+
+    def record_digest(stat):
+        _saved_digests[filename] = (digest, _file_signature(stat))
+
+    queue_write(filename, payload, on_written=record_digest)
+    with _saved_resumes_lock:
+        _saved_resumes.add(_resume_name(os.path.basename(filename)))
+        _saved_since_scan.add(_resume_name(os.path.basename(filename)))
 
 
 # ✅ Function to load saved resume data
-def load_resume_data(name):
-    """Loads saved resume data from JSON."""
-    filename = os.path.join(SAVE_DIR, f"{name.replace(' ', '_')}_resume.json")
+async def load_resume_data(name):
+    """Loads saved resume data from JSON without blocking the event loop."""
+    filename = _resume_path(name)
+    with _pending_lock:
+        payload = _pending_writes.get(filename)
+    if payload is not None:
+        return orjson.loads(payload)
     if os.path.exists(filename):
         try:
-            with open(filename, "r") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
+            async with aiofiles.open(filename, "rb") as f:
+                return orjson.loads(await f.read())
+        except orjson.JSONDecodeError:
             print(f"⚠️ Error loading JSON: Corrupt or invalid file -> {filename}")
             return None
     return None
@@ -74,147 +451,446 @@ def load_resume_data(name):
 
 # ✅ Function to list saved resumes
 def get_saved_resumes():
-    """Retrieves a list of saved resumes."""
-    return [file.replace("_resume.json", "").replace("_", " ") for file in os.listdir(SAVE_DIR) if file.endswith("_resume.json")]
+    """Retrieves a list of saved resumes, rescanning SAVE_DIR at most every SAVED_RESUMES_RESCAN_SECONDS."""
+    global _saved_resumes, _saved_resumes_scanned_at
+    now = time.monotonic()
+    with _saved_resumes_lock:
+        rescan = _saved_resumes_scanned_at is None or now - _saved_resumes_scanned_at >= SAVED_RESUMES_RESCAN_SECONDS
+        if rescan:
+            _saved_resumes_scanned_at = now  # Claim the rescan so concurrent callers keep using the current set
+            _saved_since_scan.clear()
+    if rescan:
+        # Snapshot queued saves before scanning: each is then either in the snapshot or already on disk
+        with _pending_lock:
+            scanned = {_resume_name(os.path.basename(filename)) for filename in _pending_writes
+                       if filename.endswith(RESUME_SUFFIX)}
+        with os.scandir(SAVE_DIR) as entries:
+            scanned.update(_resume_name(entry.name) for entry in entries
+                           if entry.name.endswith(RESUME_SUFFIX) and entry.is_file())
+        # Swap the new set in whole, so readers never see a partial scan
+        with _saved_resumes_lock:
+            _saved_resumes = scanned | _saved_since_scan
+    with _saved_resumes_lock:
+        return sorted(_saved_resumes)
+
+
+# ✅ Function to compute the semantic cache scope for a prompt
+def semantic_scope(*fields):
+    """Returns a hash of the identity fields a semantic cache hit must match exactly."""
+    return hashlib.blake2b("\x1f".join(fields).encode("utf-8"), digest_size=16).hexdigest()
+
+
+# ✅ Function to find a semantically similar cached prompt
+def find_similar_prompt(embedding, scope):
+    """Returns the cache key of the closest cached prompt in the same scope if it is above SEMANTIC_THRESHOLD."""
+    with _semantic_lock:
+        if not _semantic_count:
+            return None
+        scores = _semantic_embeddings[:_semantic_count] @ embedding
+        scores[_semantic_scopes[:_semantic_count] != scope] = -np.inf
+        best = int(np.argmax(scores))
+        return _semantic_keys[best] if scores[best] >= SEMANTIC_THRESHOLD else None
+
+
+# ✅ Function to remember a prompt embedding in the semantic cache
+def add_to_semantic_index(embedding, key, scope):
+    """Adds a prompt embedding to the semantic cache; the background flusher persists it."""
+    with _semantic_lock:
+        _append_semantic_row(embedding, key, scope)
+
+
+# ✅ Function to embed a prompt for semantic cache lookups
+async def embed_prompt(prompt):
+    """Returns the L2-normalised embedding of a prompt, or None if embedding fails."""
+    try:
+        result = await on_gemini_loop(genai.embed_content_async(model=EMBEDDING_MODEL, content=prompt))
+    except Exception as e:
+        print(f"⚠️ Error embedding prompt: {e}")
+        return None
+    embedding = np.asarray(result["embedding"], dtype=np.float32)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm else None
+
+
+# ✅ Function to read a cached response from disk
+def read_cached_response(key):
+    """Returns the cached response text for a key, or None if it is neither queued nor on disk."""
+    cache_file = os.path.join(CACHE_DIR, f"{key}.txt")
+    with _pending_lock:
+        payload = _pending_writes.get(cache_file)
+    if payload is not None:
+        return payload.decode("utf-8")
+    if not os.path.exists(cache_file):
+        return None
+    with open(cache_file, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+# ✅ Function to compute the response cache key for a prompt
+def cache_key(prompt):
+    """Returns the SHA-256 cache key for a prompt sent to the shared Gemini model."""
+    return hashlib.sha256(f"{GEMINI.model_name}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+# ✅ Function to store a response in the cache
+def store_cached_response(key, text):
+    """Queues a response for the on-disk cache and adds it to the in-process LRU."""
+    queue_write(os.path.join(CACHE_DIR, f"{key}.txt"), text.encode("utf-8"))
+    remember_response(key, text)
+
+
+# ✅ Function to add a response to the in-process LRU
+def remember_response(key, text):
+    """Adds a response to the in-process LRU, evicting the oldest entry when full."""
+    with _response_cache_lock:
+        _response_cache[key] = text
+        _response_cache.move_to_end(key)
+        if len(_response_cache) > CACHE_MAX_ENTRIES:
+            _response_cache.popitem(last=False)
+
+
+# ✅ Function to look up an exact-match cached response
+def get_cached_response(key):
+    """Returns the cached response for a key from memory or disk, or None on a miss."""
+    text = lookup_response(key)
+    if text is not None:
+        return text
+    text = read_cached_response(key)
+    if text is not None:
+        remember_response(key, text)
+    return text
+
+
+# ✅ Function to look up a cached response without blocking the event loop
+async def get_cached_response_async(key):
+    """Like get_cached_response, but reads disk on a worker thread; in-memory hits return directly."""
+    text = lookup_response(key)
+    if text is not None:
+        return text
+    return await asyncio.to_thread(get_cached_response, key)
+
+
+# ✅ Function to look up the in-process LRU
+def lookup_response(key):
+    """Returns the response for a key from the in-process LRU, or None if it is not there."""
+    with _response_cache_lock:
+        text = _response_cache.get(key)
+        if text is not None:
+            _response_cache.move_to_end(key)
+        return text
+
+
+# ✅ Function to call Gemini with a prompt-keyed response cache
+async def cached_generate(prompt, scope=None, use_cache=True):
+    """Returns Gemini's response text for a prompt, reusing cached responses for identical prompts and,
+    when a scope is given, for near-identical prompts in the same scope. With use_cache=False the
+    cache is bypassed but still refreshed with the new response. Gemini errors propagate to the caller."""
+    key = cache_key(prompt)
+    embedding = None
+    if use_cache:
+        text = await get_cached_response_async(key)
+        if text is not None:
+            return text
+
+        embedding = await embed_prompt(prompt) if scope is not None else None
+        similar_key = find_similar_prompt(embedding, scope) if embedding is not None else None
+        text = await get_cached_response_async(similar_key) if similar_key else None
+        if text is not None:
+            remember_response(key, text)
+            return text
+
+    response = await on_gemini_loop(GEMINI.generate_content_async(prompt))
+    text = response.text.strip()
+    store_cached_response(key, text)
+    if embedding is not None:
+        add_to_semantic_index(embedding, key, scope)
+    return text
+
+
+# ✅ Function to stream Gemini output chunk by chunk
+def stream_generate(prompt):
+    """Yields Gemini's response text for a prompt as it arrives, serving exact cache hits in one chunk."""
+    key = cache_key(prompt)
+    text = get_cached_response(key)
+    if text is not None:
+        yield text
+        return
+
+    parts = []
+    for chunk in GEMINI.generate_content(prompt, stream=True):
+        parts.append(chunk.text)
+        yield chunk.text
+    store_cached_response(key, "".join(parts).strip())
+
+
+# ✅ Function to generate a full response synchronously
+def generate_text(prompt):
+    """Returns Gemini's complete response text for a prompt, for use from worker threads."""
+    return "".join(stream_generate(prompt)).strip()
 
 
 # ✅ Function to generate ATS-optimized resume
-def generate_resume(name, job_title, experience_summary, work_experience, education, certifications, skills):
+async def generate_resume(name, job_title, experience_summary, work_experience, education, certifications, skills):
     """Generates an ATS-ready resume using Google Gemini AI."""
     if not all([name, job_title, experience_summary, work_experience, education, skills]):
         return "Error: Missing required fields for resume generation."
 
-    model = genai.GenerativeModel("gemini-pro")
-    prompt = f"""
-    Create a professional ATS-optimized resume for {name}, applying for {job_title}.
-    - **Professional Summary** (Concise, keyword-rich)
-    - **Education** (Degrees, Institutions)
-    - **Work Experience** (2-4 positions with bullet points)
-    - **Certifications** (If applicable)
-    - **Skills** (Optimized for ATS parsing)
-
-    Experience Summary: {experience_summary}
-    Work Experience: {work_experience}
-    Education: {education}
-    Certifications: {certifications or "None"}
-    Skills: {skills}
-    """
-
+    prompt = build_resume_prompt(name, job_title, experience_summary, work_experience, education, certifications, skills)
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return await cached_generate(prompt, scope=semantic_scope(name, job_title))
     except Exception as e:
         print(f"⚠️ Error generating resume: {e}")
         return "⚠️ Unable to generate resume due to an error."
 
 
-# ✅ Function to analyze ATS optimization score
-def analyze_ats_score(resume_text):
-    """Analyzes ATS compatibility, missing keywords, and suggests improvements."""
-    model = genai.GenerativeModel("gemini-pro")
-
-    prompt = f"""
-    Analyze this resume for ATS (Applicant Tracking System) compatibility.
-    - Provide an **ATS Score (0-100)**
-    - Identify **missing critical keywords**
-    - Suggest **improvements for better ATS ranking**
+def build_resume_prompt(name, job_title, experience_summary, work_experience, education, certifications, skills):
+    """Builds the Gemini prompt for resume generation."""
+    return RESUME_PROMPT.format(name=name, job_title=job_title, experience_summary=experience_summary,
+                                work_experience=work_experience, education=education,
+                                certifications=certifications or "None", skills=skills)
 
-    Resume Text:
-    {resume_text}
-    """
 
+# ✅ Function to analyze ATS optimization score
+async def analyze_ats_score(resume_text):
+    """Analyzes ATS compatibility, missing keywords, and suggests improvements."""
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return await cached_generate(build_ats_prompt(resume_text))
     except Exception as e:
         print(f"⚠️ Error analyzing ATS score: {e}")
         return "⚠️ Unable to analyze ATS compatibility."
-    
-def generate_cover_letter(name, job_title, company, experience_summary, skills):
+
+
+def build_ats_prompt(resume_text):
+    """Builds the Gemini prompt for ATS analysis, truncating long resumes to ATS_MAX_RESUME_CHARS."""
+    if len(resume_text) > ATS_MAX_RESUME_CHARS:
+        # Cut at a line boundary; ATS keywords cluster in the top sections anyway
+        cut = resume_text.rfind("\n", 0, ATS_MAX_RESUME_CHARS)
+        resume_text = resume_text[:cut if cut > 0 else ATS_MAX_RESUME_CHARS]
+    return ATS_PROMPT.format(resume_text=resume_text)
+
+
+async def generate_cover_letter(name, job_title, company, experience_summary, skills):
     """Generate a professional, ATS-optimized cover letter using Gemini AI."""
     if not all([name, job_title, company, experience_summary, skills]):
         return "⚠️ Error: Missing required fields for cover letter generation."
 
-    model = genai.GenerativeModel("gemini-pro")
-    prompt = f"""
-    Write a compelling, ATS-friendly personalized cover letter for {name} applying to {company} as a {job_title}.
-    
-    Guidelines:
-    - Start with a strong **introduction** addressing the hiring manager.
-    - Highlight **why you're the perfect fit** (using experience & skills).
-    - End with a **call to action** requesting an interview.
-    - Keep the tone **professional, confident, and enthusiastic**.
-
-    Experience Summary: {experience_summary}
-    Skills: {skills}
-    """
-
+    prompt = build_cover_letter_prompt(name, job_title, company, experience_summary, skills)
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()  # Ensure no extra whitespace
+        return await cached_generate(prompt, scope=semantic_scope(name, job_title, company))
     except Exception as e:
         print(f"❌ Error generating cover letter: {e}")
         return f"⚠️ Error generating cover letter content: {str(e)}"
 
 
+def build_cover_letter_prompt(name, job_title, company, experience_summary, skills):
+    """Builds the Gemini prompt for cover letter generation."""
+    return COVER_LETTER_PROMPT.format(name=name, job_title=job_title, company=company,
+                                      experience_summary=experience_summary, skills=skills)
+
+
+# ✅ Function to regenerate a saved resume from its stored profile
+async def regenerate_saved_resume(name, semaphore):
+    """Regenerates the resume, cover letter and ATS feedback for a saved profile and saves the result.
+    Returns False, leaving the saved file untouched, if the profile is incomplete or any Gemini call fails."""
+    resume_data = await load_resume_data(name)
+    if resume_data is None or not has_required_fields(resume_data):
+        return False
+
+    profile_name, job_title, company = resume_data.get("name", name), resume_data.get("job_title", ""), resume_data.get("company", "")
+    experience_summary, skills = resume_data.get("experience_summary", ""), resume_data.get("skills", "")
+    # Call cached_generate directly: the generate_* helpers turn failures into error text, which must not be saved
+    jobs = [cached_generate(build_resume_prompt(profile_name, job_title, experience_summary, resume_data.get("work_experience", ""),
+                                                resume_data.get("education", ""), resume_data.get("certifications", ""),
+                                                skills),
+                            scope=semantic_scope(profile_name, job_title), use_cache=False)]
+    if company:  # Without a company no cover letter can be written, so the saved one is kept
+        jobs.append(cached_generate(build_cover_letter_prompt(profile_name, job_title, company, experience_summary, skills),
+                                    scope=semantic_scope(profile_name, job_title, company), use_cache=False))
+    async with semaphore:
+        try:
+            resume_text, *cover_letter = await asyncio.gather(*jobs)
+            ats_feedback = await cached_generate(build_ats_prompt(resume_text), use_cache=False)
+        except Exception as e:
+            print(f"⚠️ Error regenerating resume for {name}: {e}")
+            return False
+    cover_letter_text = cover_letter[0] if cover_letter else resume_data.get("cover_letter_text", "")
+
+    resume_data.update({
+        "resume_text": resume_text,
+        "cover_letter_text": cover_letter_text,
+        "ats_feedback": render_markdown(ats_feedback)
+    })
+    save_resume_data(name, resume_data)
+    return True
+
+
+# ✅ Function to regenerate saved resumes in the background
+async def run_batch_regenerate(names):
+    """Regenerates the given saved resumes, up to BATCH_CONCURRENCY at a time, logs the outcome and
+    returns the names that failed."""
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    results = await asyncio.gather(*(regenerate_saved_resume(name, semaphore) for name in names),
+                                   return_exceptions=True)
+    failed = []
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            print(f"⚠️ Error regenerating resume for {name}: {result}")
+        if result is not True:
+            failed.append(name)
+    print(f"✅ Batch regeneration finished: {len(names) - len(failed)} regenerated, {len(failed)} failed {failed}")
+    return failed
+
+
+# ✅ Function to read the resume form fields
+def read_resume_form():
+    """Returns the submitted resume form fields, stripped of surrounding whitespace."""
+    fields = ["name", "job_title", "company", "experience_summary", "work_experience", "education", "certifications", "skills"]
+    return {field: request.form.get(field, "").strip() for field in fields}
+
+
+# ✅ Function to check the form before any Gemini call
+def has_required_fields(form):
+    """Returns True if every field required for resume generation was filled in."""
+    return all(form.get(field) for field in RESUME_REQUIRED_FIELDS)
+
+
+# ✅ Function to format a Server-Sent Event
+def sse_event(event, text):
+    """Formats text as a Server-Sent Event, prefixing every line with 'data:'. SSE treats CRLF, CR
+    and LF alike as line ends, so all three are split on."""
+    data = "\n".join(f"data: {line}" for line in re.split(r"\r\n|\r|\n", text))
+    return f"event: {event}\n{data}\n\n"
+
+
 # ✅ Flask Route: Home Page
 @app.route("/", methods=["GET", "POST"])
-def index():
+async def index():
+    """Renders the form and, on submit, generates the resume, cover letter and ATS feedback."""
     resume_text = None
     cover_letter_text = None
     ats_feedback = None
+    error = None
     saved_resumes = get_saved_resumes()
 
     if request.method == "POST":
         if "generate_resume_btn" in request.form:
-            name = request.form.get("name", "").strip()
-            job_title = request.form.get("job_title", "").strip()
-            company = request.form.get("company", "").strip()
-            experience_summary = request.form.get("experience_summary", "").strip()
-            work_experience = request.form.get("work_experience", "").strip()
-            education = request.form.get("education", "").strip()
-            certifications = request.form.get("certifications", "").strip()
-            skills = request.form.get("skills", "").strip()
-
-            resume_text = generate_resume(name, job_title, experience_summary, work_experience, education, certifications, skills)
-            ats_feedback = analyze_ats_score(resume_text)
-            cover_letter_text = generate_cover_letter(name, job_title, company, experience_summary, skills)
-
-            # Convert ATS feedback markdown to HTML
-            ats_feedback = markdown(ats_feedback)
-
-            
-
-            resume_data = {
-                "name": name,
-                "job_title": job_title,
-                "company": company,
-                "experience_summary": experience_summary,
-                "work_experience": work_experience,
-                "education": education,
-                "certifications": certifications,
-                "skills": skills,
-                "resume_text": resume_text,
-                "cover_letter_text": cover_letter_text,
-                "ats_feedback": ats_feedback
-            }
-            save_resume_data(name, resume_data)
+            form = read_resume_form()
+            if not has_required_fields(form):
+                # Reject incomplete submissions before any Gemini call is made
+                error = "Missing required fields for resume generation."
+            else:
+                name = form["name"]
+
+                # Resume and cover letter are independent, so run them concurrently;
+                # the ATS analysis needs the finished resume and follows after.
+                resume_text, cover_letter_text = await asyncio.gather(
+                    generate_resume(name, form["job_title"], form["experience_summary"], form["work_experience"],
+                                    form["education"], form["certifications"], form["skills"]),
+                    generate_cover_letter(name, form["job_title"], form["company"], form["experience_summary"],
+                                          form["skills"]),
+                )
+                ats_feedback = await analyze_ats_score(resume_text)
+
+                # Convert ATS feedback markdown to HTML
+                ats_feedback = render_markdown(ats_feedback)
+
+                resume_data = {
+                    **form,
+                    "resume_text": resume_text,
+                    "cover_letter_text": cover_letter_text,
+                    "ats_feedback": ats_feedback
+                }
+                save_resume_data(name, resume_data)
 
     return render_template("index.html",
                            resume_text=resume_text,
                            cover_letter_text=cover_letter_text,
                            ats_feedback=ats_feedback,
+                           error=error,
                            saved_resumes=saved_resumes)
 
 
+# ✅ Flask Route: Stream generation as Server-Sent Events
+@app.route("/stream", methods=["POST"])
+def stream():
+    """Streams the resume, ATS analysis and cover letter to the browser as they are generated."""
+    form = read_resume_form()
+    if not has_required_fields(form):
+        abort(400, "Missing required fields for resume generation.")
+
+    # The cover letter does not depend on the resume, so start it on a worker thread
+    # while the resume and ATS analysis stream, and send it once both are done.
+    cover_letter_future = None
+    if form["company"]:
+        cover_letter_future = EXEC.submit(generate_text, build_cover_letter_prompt(
+            form["name"], form["job_title"], form["company"], form["experience_summary"], form["skills"]))
+
+    def generate():
+        try:
+            resume_parts = []
+            for chunk in stream_generate(build_resume_prompt(
+                    form["name"], form["job_title"], form["experience_summary"], form["work_experience"],
+                    form["education"], form["certifications"], form["skills"])):
+                resume_parts.append(chunk)
+                yield sse_event("resume", chunk)
+            resume_text = "".join(resume_parts).strip()
+
+            ats_parts = []
+            for chunk in stream_generate(build_ats_prompt(resume_text)):
+                ats_parts.append(chunk)
+                yield sse_event("ats", chunk)
+
+            cover_letter_text = ""
+            if cover_letter_future is not None:
+                cover_letter_text = cover_letter_future.result()
+                yield sse_event("cover_letter", cover_letter_text)
+        except Exception as e:
+            print(f"⚠️ Error streaming generation: {e}")
+            yield sse_event("error", "⚠️ Unable to complete generation due to an error.")
+            return
+        finally:
+            # Also runs on GeneratorExit when the client disconnects mid-stream; a no-op once the letter is done
+            if cover_letter_future is not None:
+                cover_letter_future.cancel()
+
+        save_resume_data(form["name"], {
+            **form,
+            "resume_text": resume_text,
+            "cover_letter_text": cover_letter_text,
+            "ats_feedback": render_markdown("".join(ats_parts).strip())
+        })
+        yield sse_event("done", "")
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ✅ Flask Route: Regenerate all saved resumes
+@app.route("/batch_regenerate", methods=["POST"])
+def batch_regenerate():
+    """Queues regeneration of every saved resume on the Gemini loop and returns 202 immediately.
+    Disabled (404) unless BATCH_REGENERATE_TOKEN is set, and requires it in the X-Batch-Token header.
+    Only one job runs at a time per worker process; other workers each keep their own job."""
+    global _batch_job
+    if not BATCH_REGENERATE_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get("X-Batch-Token", "").encode(), BATCH_REGENERATE_TOKEN.encode()):
+        abort(403)
+    with _batch_lock:
+        if _batch_job is not None and not _batch_job.done():
+            return jsonify({"error": "Batch regeneration already in progress."}), 409
+        names = get_saved_resumes()
+        _batch_job = asyncio.run_coroutine_threadsafe(run_batch_regenerate(names), _gemini_loop)
+    return jsonify({"queued": names}), 202
+
+
 # ✅ Flask Route: Download Resume
 @app.route("/download_resume/<filename>")
 def download_resume(filename):
-    """Allows users to download saved resumes."""
-    filepath = os.path.join(SAVE_DIR, filename)
-    return send_file(filepath, as_attachment=True) if os.path.exists(filepath) else abort(404, "File not found.")
+    """Allows users to download saved resumes, with ETag/Range support and X-Sendfile when enabled."""
+    return send_from_directory(SAVE_DIR, filename, as_attachment=True, conditional=True, etag=True)
 
 
-# ✅ Run the Flask app
+# ✅ Run the Flask app (production: hypercorn asgi:app, see Procfile)
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,26 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from app import app as flask_app
+
+# Flask is a WSGI app: under hypercorn every request, including async views awaiting Gemini,
+# occupies one executor thread until it finishes. Size that pool explicitly instead of relying
+# on asyncio's default (min(32, cpu_count + 4)), since requests spend most of their time waiting.
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "64"))
+# hypercorn's WSGI middleware buffers whole request bodies and would otherwise reject anything
+# over its 64 KiB default with a 400, which long pasted work histories can exceed.
+WSGI_MAX_BODY_SIZE = int(os.getenv("WSGI_MAX_BODY_SIZE", str(16 * 1024 * 1024)))
+
+_wsgi = AsyncioWSGIMiddleware(flask_app, max_body_size=WSGI_MAX_BODY_SIZE)
+_executor = None
+
+
+# ✅ ASGI entry point for hypercorn (see Procfile)
+async def app(scope, receive, send):
+    """Serves the Flask app on hypercorn with a thread pool of WSGI_THREADS per worker."""
+    global _executor
+    if _executor is None and scope["type"] == "http":
+        _executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+        asyncio.get_running_loop().set_default_executor(_executor)
+    await _wsgi(scope, receive, send)
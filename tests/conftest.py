@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# app.py needs an API key at import time and creates its "saves" directory relative to the
+# working directory, so give it a dummy key and a throwaway directory before tests import it.
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.chdir(tempfile.mkdtemp(prefix="airesumeapp-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
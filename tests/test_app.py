@@ -0,0 +1,331 @@
+import asyncio
+import os
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import numpy as np
+import orjson
+import pytest
+
+import app
+
+
+def test_resume_path_stays_inside_save_dir():
+    path = app._resume_path("../../etc/passwd")
+    assert os.path.dirname(path) == app.SAVE_DIR
+    assert "/" not in os.path.basename(path)
+
+
+def test_resume_path_round_trips_and_keeps_names_distinct():
+    names = ["John Doe", "José", "Jos_", "Jos ", "O'Brien", "100%", ".."]
+    files = [os.path.basename(app._resume_path(name)) for name in names]
+    assert len(set(files)) == len(names)
+    assert [app._resume_name(file) for file in files] == names
+
+
+def test_resume_path_keeps_legacy_space_names():
+    assert os.path.basename(app._resume_path("John Doe")) == "John_Doe_resume.json"
+
+
+def test_migrate_legacy_resumes_renames_unencoded_files():
+    legacy = os.path.join(app.SAVE_DIR, "Mc'Legacy_resume.json")
+    with open(legacy, "w") as f:
+        f.write("{}")
+
+    app._migrate_legacy_resumes()
+
+    assert not os.path.exists(legacy)
+    assert os.path.exists(app._resume_path("Mc'Legacy"))
+
+
+def test_migrate_legacy_resumes_skips_taken_names():
+    legacy = os.path.join(app.SAVE_DIR, "Mc'Taken_resume.json")
+    target = app._resume_path("Mc'Taken")
+    for path, content in ((legacy, "legacy"), (target, "current")):
+        with open(path, "w") as f:
+            f.write(content)
+
+    app._migrate_legacy_resumes()
+
+    with open(target) as f:
+        assert f.read() == "current"
+    assert os.path.exists(legacy)
+
+
+@pytest.fixture
+def empty_semantic_index(monkeypatch):
+    monkeypatch.setattr(app, "_semantic_embeddings", None)
+    monkeypatch.setattr(app, "_semantic_scopes", np.empty(0, dtype="U32"))
+    monkeypatch.setattr(app, "_semantic_keys", [])
+    monkeypatch.setattr(app, "_semantic_count", 0)
+    monkeypatch.setattr(app, "_semantic_next", 0)
+    monkeypatch.setattr(app, "_semantic_dirty", False)
+
+
+def _unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_find_similar_prompt_only_matches_same_scope(empty_semantic_index):
+    scope_a, scope_b = app.semantic_scope("Ann", "Engineer"), app.semantic_scope("Bob", "Engineer")
+    app.add_to_semantic_index(_unit(1, 0, 0), "key-a", scope_a)
+
+    assert app.find_similar_prompt(_unit(1, 0, 0), scope_a) == "key-a"
+    assert app.find_similar_prompt(_unit(1, 0, 0), scope_b) is None
+    assert app.find_similar_prompt(_unit(0, 1, 0), scope_a) is None
+
+
+def test_semantic_index_evicts_oldest_rows_when_full(empty_semantic_index, monkeypatch):
+    monkeypatch.setattr(app, "SEMANTIC_MAX_ENTRIES", 20)
+    scope = app.semantic_scope("Ann")
+    for i in range(25):
+        app.add_to_semantic_index(_unit(*(np.arange(25) == i)), f"key-{i}", scope)
+
+    assert app._semantic_count == 20
+    assert len(app._semantic_embeddings) == 20
+    assert app.find_similar_prompt(_unit(*(np.arange(25) == 0)), scope) is None
+    assert app.find_similar_prompt(_unit(*(np.arange(25) == 24)), scope) == "key-24"
+
+
+def test_load_semantic_index_compacts_files_of_exited_workers(empty_semantic_index):
+    stale = os.path.join(app.CACHE_DIR, f"{app.SEMANTIC_INDEX_PREFIX}999999999.npz")
+    np.savez(stale, embeddings=np.array([_unit(1, 0)]), keys=np.array(["old-key"]),
+             scopes=np.array([app.semantic_scope("Ann")]))
+
+    app.load_semantic_index()
+
+    assert not os.path.exists(stale)
+    assert app.find_similar_prompt(_unit(1, 0), app.semantic_scope("Ann")) == "old-key"
+    with np.load(app.SEMANTIC_INDEX_FILE) as data:
+        assert list(data["keys"]) == ["old-key"]
+
+
+def test_sse_event_prefixes_every_line():
+    assert app.sse_event("resume", "a\nb") == "event: resume\ndata: a\ndata: b\n\n"
+
+
+def test_sse_event_splits_carriage_returns():
+    assert app.sse_event("resume", "a\r\nb\rc") == "event: resume\ndata: a\ndata: b\ndata: c\n\n"
+
+
+def test_sse_event_empty_payload():
+    assert app.sse_event("done", "") == "event: done\ndata: \n\n"
+
+
+PROFILE = {"name": "Batch Tester", "job_title": "Engineer", "company": "Acme", "experience_summary": "5 years",
+           "work_experience": "Acme", "education": "BSc", "certifications": "", "skills": "Python",
+           "resume_text": "old resume", "cover_letter_text": "old letter", "ats_feedback": "old feedback"}
+
+
+@pytest.fixture
+def batch_client(monkeypatch):
+    monkeypatch.setattr(app, "BATCH_REGENERATE_TOKEN", "secret")
+    app.save_resume_data(PROFILE["name"], dict(PROFILE))
+    app._write_queue.join()
+    return app.app.test_client()
+
+
+def _run_batch(client):
+    response = client.post("/batch_regenerate", headers={"X-Batch-Token": "secret"})
+    failed = app._batch_job.result(timeout=10)
+    app._write_queue.join()
+    with open(app._resume_path(PROFILE["name"]), "rb") as f:
+        return response, failed, orjson.loads(f.read())
+
+
+def test_batch_regenerate_saves_regenerated_profiles(batch_client, monkeypatch):
+    async def generate(prompt):
+        return SimpleNamespace(text="new text")
+    monkeypatch.setattr(app.GEMINI, "generate_content_async", generate)
+
+    response, failed, saved = _run_batch(batch_client)
+
+    assert response.status_code == 202
+    assert PROFILE["name"] in response.get_json()["queued"]
+    assert PROFILE["name"] not in failed
+    assert saved["resume_text"] == saved["cover_letter_text"] == "new text"
+
+
+def test_batch_regenerate_keeps_saved_file_when_gemini_fails(batch_client, monkeypatch):
+    async def generate(prompt):
+        raise RuntimeError("quota exceeded")
+    monkeypatch.setattr(app.GEMINI, "generate_content_async", generate)
+
+    response, failed, saved = _run_batch(batch_client)
+
+    assert response.status_code == 202
+    assert PROFILE["name"] in failed
+    assert saved == PROFILE
+
+
+def test_batch_regenerate_requires_token(batch_client, monkeypatch):
+    assert batch_client.post("/batch_regenerate").status_code == 403
+    assert batch_client.post("/batch_regenerate", headers={"X-Batch-Token": "wrong"}).status_code == 403
+    monkeypatch.setattr(app, "BATCH_REGENERATE_TOKEN", None)
+    assert batch_client.post("/batch_regenerate", headers={"X-Batch-Token": "secret"}).status_code == 404
+
+
+def test_get_saved_resumes_sees_own_saves_without_rescan(monkeypatch):
+    app.get_saved_resumes()
+    monkeypatch.setattr(app, "SAVED_RESUMES_RESCAN_SECONDS", 3600)
+    other_worker = app._resume_path("Other Worker")
+    with open(other_worker, "wb") as f:
+        f.write(b"{}")
+
+    app.save_resume_data("Own Save", {"name": "Own Save"})
+
+    names = app.get_saved_resumes()
+    assert "Own Save" in names
+    assert "Other Worker" not in names
+    monkeypatch.setattr(app, "SAVED_RESUMES_RESCAN_SECONDS", 0)
+    assert "Other Worker" in app.get_saved_resumes()
+    app._write_queue.join()
+
+
+def test_write_atomic_uses_umask_permissions(tmp_path):
+    filename = str(tmp_path / "file.json")
+    app.write_atomic(filename, b"{}")
+    assert os.stat(filename).st_mode & 0o777 == 0o666 & ~app._UMASK
+
+
+def test_load_resume_data_sees_pending_write():
+    filename = app._resume_path("Pending Load")
+    with app._pending_lock:  # Queued but not yet written, as if the writer were busy
+        app._pending_writes[filename] = orjson.dumps({"name": "Pending Load"})
+    try:
+        assert asyncio.run(app.load_resume_data("Pending Load")) == {"name": "Pending Load"}
+    finally:
+        with app._pending_lock:
+            del app._pending_writes[filename]
+
+
+def _classify(line):
+    return app.PDF_LINE_RE.match(line).group("header", "rest", "bullet", "text")
+
+
+def test_pdf_line_re_headers():
+    assert _classify("**Skills**") == ("Skills", "", None, None)
+    assert _classify("**Skills:** Python") == ("Skills:", " Python", None, None)
+
+
+def test_pdf_line_re_bullets():
+    assert _classify("- Python") == (None, None, "Python", None)
+    assert _classify("  * **Python:** 5 years") == (None, None, "**Python:** 5 years", None)
+
+
+def test_pdf_line_re_plain_text():
+    assert _classify("-5% costs") == (None, None, None, "-5% costs")
+    assert _classify("Full-stack developer") == (None, None, None, "Full-stack developer")
+    assert _classify("") == (None, None, None, "")
+
+
+def test_render_pdf_produces_pdf():
+    pdf = app.render_pdf("**Summary**\nEngineer with “smart quotes” and ✓ symbols\n- **Python:** 5 years\n\nPlain line")
+    assert pdf.startswith(b"%PDF")
+
+
+def test_read_cached_response_sees_pending_write():
+    key = app.cache_key("pending prompt")
+    cache_file = os.path.join(app.CACHE_DIR, f"{key}.txt")
+    with app._pending_lock:
+        app._pending_writes[cache_file] = "queued answer".encode("utf-8")
+    try:
+        assert app.read_cached_response(key) == "queued answer"
+    finally:
+        with app._pending_lock:
+            del app._pending_writes[cache_file]
+    assert app.read_cached_response(key) is None
+
+
+def test_index_rejects_incomplete_form_without_calling_gemini(monkeypatch):
+    rendered = {}
+
+    def render_template(template, **context):
+        rendered.update(context)
+        return ""
+
+    async def generate(prompt):
+        raise AssertionError("Gemini must not be called for an incomplete form")
+
+    monkeypatch.setattr(app, "render_template", render_template)
+    monkeypatch.setattr(app.GEMINI, "generate_content_async", generate)
+    monkeypatch.setattr(app.genai, "embed_content_async", generate)
+
+    response = app.app.test_client().post("/", data={"generate_resume_btn": "1", "name": "Ann", "job_title": " "})
+
+    assert response.status_code == 200
+    assert rendered["error"] == "Missing required fields for resume generation."
+    assert rendered["resume_text"] is None
+
+
+@pytest.fixture
+def queued_writes(monkeypatch):
+    writes = []
+    queue_write = app.queue_write
+
+    def spy(filename, payload, on_written=None):
+        writes.append(filename)
+        queue_write(filename, payload, on_written)
+
+    monkeypatch.setattr(app, "queue_write", spy)
+    return writes
+
+
+def test_save_resume_data_skips_identical_save(queued_writes):
+    app.save_resume_data("Dedup", {"name": "Dedup"})
+    app._write_queue.join()
+    app.save_resume_data("Dedup", {"name": "Dedup"})
+    assert len(queued_writes) == 1
+
+
+def test_save_resume_data_skips_identical_pending_save(queued_writes):
+    filename = app._resume_path("Dedup Pending")
+    payload = orjson.dumps({"name": "Dedup Pending"}, option=orjson.OPT_INDENT_2)
+    with app._pending_lock:  # Queued but not yet written, as if the writer were busy
+        app._pending_writes[filename] = payload
+    try:
+        app.save_resume_data("Dedup Pending", {"name": "Dedup Pending"})
+        assert queued_writes == []
+    finally:
+        with app._pending_lock:
+            del app._pending_writes[filename]
+
+
+def test_save_resume_data_rewrites_file_replaced_on_disk(queued_writes):
+    app.save_resume_data("Dedup Replaced", {"name": "Dedup Replaced"})
+    app._write_queue.join()
+    app.write_atomic(app._resume_path("Dedup Replaced"), b'{"name": "Another worker"}')
+
+    app.save_resume_data("Dedup Replaced", {"name": "Dedup Replaced"})
+    app._write_queue.join()
+
+    assert len(queued_writes) == 2
+    assert asyncio.run(app.load_resume_data("Dedup Replaced")) == {"name": "Dedup Replaced"}
+
+
+def test_stream_cancels_cover_letter_when_client_disconnects(monkeypatch):
+    future = Future()  # Never started, as if every EXEC thread were busy
+    monkeypatch.setattr(app, "EXEC", SimpleNamespace(submit=lambda *args: future))
+    monkeypatch.setattr(app, "stream_generate", lambda prompt: iter(["chunk"]))
+    form = {"company": "Acme", **{field: "x" for field in app.RESUME_REQUIRED_FIELDS}}
+
+    response = app.app.test_client().post("/stream", data=form, buffered=False)
+    next(response.response)
+    response.close()
+
+    assert future.cancelled()
+
+
+def test_build_ats_prompt_keeps_short_resumes_whole():
+    resume = "Line one\nLine two"
+    assert app.build_ats_prompt(resume) == app.ATS_PROMPT.format(resume_text=resume)
+
+
+def test_build_ats_prompt_truncates_at_line_boundary():
+    resume = ("x" * 99 + "\n") * 200
+    prompt = app.build_ats_prompt(resume)
+    included = prompt[len(app.ATS_PROMPT.split("{resume_text}")[0]):]
+    assert len(included) <= app.ATS_MAX_RESUME_CHARS
+    assert resume.startswith(included)
+    assert included.endswith("x")